@@ -1,5 +1,5 @@
 from django.contrib import admin
-from core.models import CoinsAmount, Item, MachineItem
+from core.models import CoinsAmount, Item, Job, MachineItem
 
 
 class CoinsAmountAdmin(admin.ModelAdmin):
@@ -14,6 +14,12 @@ class MachineItemAdmin(admin.ModelAdmin):
     pass
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'priority', 'attempts', 'run_after']
+    list_filter = ['status', 'name']
+
+
 admin.site.register(CoinsAmount, CoinsAmountAdmin)
 admin.site.register(Item, ItemAdmin)
 admin.site.register(MachineItem, MachineItemAdmin)
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,41 @@
+from django_filters import rest_framework as filters
+
+from core.models import Item, MachineItem
+from core.search import filter_by_item_name
+
+
+class ItemFilter(filters.FilterSet):
+    name = filters.CharFilter(method='filter_name_prefix')
+    search = filters.CharFilter(method='filter_search')
+    min_price = filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = filters.NumberFilter(field_name='price', lookup_expr='lte')
+    volume = filters.NumberFilter(field_name='volume')
+
+    item_field = ''
+
+    class Meta:
+        model = Item
+        fields = []
+
+    def filter_name_prefix(self, queryset, name, value):
+        return filter_by_item_name(
+            queryset, self.item_field, 'istartswith', value)
+
+    def filter_search(self, queryset, name, value):
+        return filter_by_item_name(
+            queryset, self.item_field, 'icontains', value)
+
+
+class MachineItemFilter(ItemFilter):
+    min_price = filters.NumberFilter(
+        field_name='item__price', lookup_expr='gte')
+    max_price = filters.NumberFilter(
+        field_name='item__price', lookup_expr='lte')
+    volume = filters.NumberFilter(field_name='item__volume')
+    low_stock = filters.NumberFilter(field_name='count', lookup_expr='lte')
+
+    item_field = 'item__'
+
+    class Meta:
+        model = MachineItem
+        fields = []
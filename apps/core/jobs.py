@@ -0,0 +1,249 @@
+import queue
+import traceback
+
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.mixins import next_sync_version
+from core.models import CountShard, Job, MachineItem, MAX_MACHINE_ITEMS
+from core.sync import committed_sync_version, prune_tombstones
+
+
+JOB_REGISTRY = {}
+
+
+def job(name, cpu_bound=False):
+    """
+    Registers a function as a job handler. Handlers take the job payload and
+    return a JSON serializable result. CPU-bound handlers are sent to the
+    worker's process pool when it has one.
+    """
+    def decorator(func):
+        JOB_REGISTRY[name] = (func, cpu_bound)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, priority=0, max_attempts=None):
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        priority=priority,
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+    )
+
+
+def reclaim_expired_jobs():
+    """
+    Gives back the jobs whose worker stopped renewing their lease, most
+    likely because it crashed or was killed. The lost run counts as an
+    attempt. Returns how many jobs were reclaimed.
+    """
+    now = timezone.now()
+    expired = Job.objects.filter(
+        status=Job.RUNNING,
+        updated_at__lt=now - timedelta(seconds=settings.JOBS_LEASE_TIMEOUT))
+    error = "Lease expired, the worker running the job stopped"
+
+    failed = expired.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, error=error, updated_at=now)
+    retried = expired.filter(attempts__lt=F('max_attempts')).update(
+        status=Job.PENDING, error=error, run_after=now, updated_at=now)
+
+    return failed + retried
+
+
+def renew_leases(jobs):
+    Job.objects.filter(
+        pk__in=[job.pk for job in jobs], status=Job.RUNNING
+    ).update(updated_at=timezone.now())
+
+
+def claim_job():
+    """
+    Marks the next runnable job as running and returns it, or None when the
+    queue is empty. Claiming takes a lease on the job, see
+    `reclaim_expired_jobs`.
+    """
+    queryset = Job.objects.filter(
+        status=Job.PENDING, run_after__lte=timezone.now()
+    ).order_by('-priority', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = queryset.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.save(update_fields=['status', 'attempts', 'updated_at'])
+            return job
+
+    # SQLite has no row locks, so claim with a conditional update and move on
+    # to the next candidate if another worker got there first
+    for job_id in queryset.values_list('id', flat=True)[:10]:
+        claimed = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, attempts=F('attempts') + 1,
+            updated_at=timezone.now())
+        if claimed:
+            return Job.objects.get(pk=job_id)
+
+    return None
+
+
+def finish_job(job, get_result):
+    """
+    Records the outcome of a job, given a callable returning its result or
+    raising its error.
+    """
+    try:
+        result = get_result()
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+        else:
+            delay = settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1)
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+    else:
+        job.status = Job.DONE
+        job.result = result
+        job.error = ''
+
+    job.save(update_fields=[
+        'status', 'result', 'error', 'run_after', 'updated_at'])
+    return job
+
+
+def run_job(job):
+    try:
+        func, _ = JOB_REGISTRY[job.name]
+    except KeyError:
+        job.status = Job.FAILED
+        job.error = f"Unknown job: {job.name}"
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        return job
+
+    return finish_job(job, lambda: func(job.payload))
+
+
+def run_pending(executor=None, concurrency=1):
+    """
+    Runs jobs until the queue has nothing runnable left. Returns how many
+    jobs were run.
+
+    CPU-bound jobs go to `executor` when one is given, with up to
+    `concurrency` of them in flight. Their futures report back through a
+    done-callback and are finished here, on this thread's DB connection,
+    while the leases of the ones still running are renewed.
+    """
+    reclaim_expired_jobs()
+
+    completed = queue.Queue()
+    in_flight = {}
+    ran = 0
+
+    while True:
+        job = None
+        while len(in_flight) < concurrency:
+            job = claim_job()
+            if job is None:
+                break
+            ran += 1
+
+            func, cpu_bound = JOB_REGISTRY.get(job.name, (None, False))
+            if cpu_bound and executor is not None:
+                future = executor.submit(func, job.payload)
+                in_flight[future] = job
+                future.add_done_callback(completed.put)
+            else:
+                run_job(job)
+
+        if not in_flight:
+            if job is None:
+                return ran
+            continue
+
+        try:
+            future = completed.get(timeout=settings.JOBS_HEARTBEAT_INTERVAL)
+        except queue.Empty:
+            renew_leases(in_flight.values())
+            continue
+
+        finish_job(in_flight.pop(future), future.result)
+
+
+@job('refill')
+def refill(payload):
+    """
+    Refills every machine slot, one primary key range at a time so a large
+    fleet never holds a long table-wide lock.
+    """
+    chunk_size = payload.get('chunk_size', settings.JOBS_REFILL_CHUNK_SIZE)
+    last_id = 0
+    refilled = 0
+
+    while True:
+        ids = list(
+            MachineItem.objects.filter(pk__gt=last_id)
+            .order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            break
+
+        with transaction.atomic():
+            refilled += MachineItem.objects.filter(pk__in=ids).update(
+                count=MAX_MACHINE_ITEMS, version=next_sync_version())
+        last_id = ids[-1]
+
+    return {'refilled': refilled}
+
+
+@job('compact_counters')
+def compact_counters(payload):
+    """
+    Folds the shards of every sharded counter back into its base count.
+    """
+    counters = CountShard.objects.values_list(
+        'counter_type', 'counter_id').distinct()
+    compacted = 0
+
+    for counter_type, counter_id in counters:
+        model = apps.get_model(counter_type)
+        try:
+            model.objects.get(pk=counter_id).compact_count()
+        except model.DoesNotExist:
+            CountShard.objects.filter(
+                counter_type=counter_type, counter_id=counter_id).delete()
+        compacted += 1
+
+    return {'compacted': compacted}
+
+
+@job('prune_sync_versions')
+def prune_sync_versions(payload):
+    """
+    Advances the sync watermark so version rows are pruned even when no
+    machine syncs for a while, and prunes expired slot tombstones.
+    """
+    return {
+        'version': committed_sync_version(),
+        'tombstones_pruned_to': prune_tombstones(),
+    }
+
+
+@job('prune_jobs')
+def prune_jobs(payload):
+    """
+    Deletes done and failed jobs older than JOBS_RETENTION seconds.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.JOBS_RETENTION)
+    pruned, _ = Job.objects.filter(
+        status__in=[Job.DONE, Job.FAILED], updated_at__lt=cutoff).delete()
+    return {'pruned': pruned}
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from core.models import CoinsAmount, CountShard
+
+
+BENCH_COUNTER_ID = 'bench'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures coin counter write throughput with many concurrent writers, "
+        "with and without sharding. Run it against Postgres, SQLite "
+        "serializes every write anyway. Only coin inserts are sharded: vends "
+        "and refunds reset the counter, which locks the base row and every "
+        "shard, so they still serialize"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=32)
+        parser.add_argument('--ops', type=int, default=200,
+                            help="Writes per writer")
+        parser.add_argument('--shards', type=int, default=16)
+        parser.add_argument(
+            '--hold-ms', type=float, default=0,
+            help="Keep each write's transaction open this long, like the "
+                 "vend path does while it updates the slot")
+
+    def handle(self, *args, **options):
+        for shards in (0, options['shards']):
+            with override_settings(COUNTABLE_SHARDS=shards):
+                elapsed, total = self.run_writers(
+                    options['writers'], options['ops'],
+                    options['hold_ms'] / 1000)
+
+            writes = options['writers'] * options['ops']
+            self.stdout.write(
+                f"shards={shards}: {writes} writes in {elapsed:.2f}s "
+                f"({writes / elapsed:.0f} writes/s), final count {total}")
+
+    def run_writers(self, writers, ops, hold):
+        CountShard.objects.filter(
+            counter_type=CoinsAmount._meta.label_lower,
+            counter_id=BENCH_COUNTER_ID).delete()
+        CoinsAmount.objects.update_or_create(
+            id=BENCH_COUNTER_ID, defaults={'value': '0.25', 'count': 0})
+
+        barrier = threading.Barrier(writers + 1)
+
+        def write():
+            coins_amount = CoinsAmount.objects.get(pk=BENCH_COUNTER_ID)
+            barrier.wait()
+            try:
+                for _ in range(ops):
+                    with transaction.atomic():
+                        coins_amount.add_to_count(1)
+                        time.sleep(hold)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        coins_amount = CoinsAmount.objects.get(pk=BENCH_COUNTER_ID)
+        total = coins_amount.get_count()
+        coins_amount.delete()
+        CountShard.objects.filter(
+            counter_type=CoinsAmount._meta.label_lower,
+            counter_id=BENCH_COUNTER_ID).delete()
+
+        return elapsed, total
@@ -0,0 +1,127 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import reverse
+
+from core.models import Item, MachineItem, MAX_MACHINE_ITEMS
+
+
+BENCH_PREFIX = 'Bench'
+
+BRANDS = [
+    'Aqua', 'Berry', 'Citrus', 'Delta', 'Ember', 'Frost', 'Glacier', 'Harbor',
+    'Indigo', 'Juniper', 'Kiwi', 'Lumen', 'Mango', 'Nectar', 'Orchid', 'Pulse',
+]
+FLAVORS = [
+    'Cola', 'Lemon', 'Lime', 'Orange', 'Grape', 'Cherry', 'Peach', 'Mint',
+    'Ginger', 'Tonic', 'Melon', 'Apple',
+]
+
+# Share of slots that are running low, the rest are full
+LOW_STOCK_RATIO = 0.05
+
+QUERIES = {
+    'name prefix': {'name': f'{BENCH_PREFIX} Glacier'},
+    'search': {'search': 'Ginger 42'},
+    'price range': {'min_price': '1.10', 'max_price': '1.12'},
+    'low stock': {'low_stock': '0'},
+    'volume + low stock': {'volume': '0.33', 'low_stock': '0'},
+    'search + price': {'search': 'Mint', 'max_price': '0.60'},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a large catalog of benchmark slots and times filtered, "
+        "paginated and rendered inventory requests against it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--slots', type=int, default=1_000_000)
+        parser.add_argument('--items', type=int, default=20_000)
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--keep', action='store_true',
+                            help="Keep the seeded rows for another run")
+
+    def handle(self, *args, **options):
+        # The seeded rows are rolled back rather than deleted, which would
+        # leave a sync tombstone per slot
+        with transaction.atomic():
+            if not Item.objects.filter(
+                    name__startswith=BENCH_PREFIX).exists():
+                self.seed(options['items'], options['slots'])
+
+            for label, params in QUERIES.items():
+                timings, sql_timings = self.time_request(
+                    params, options['runs'], options['page_size'])
+                self.stdout.write(
+                    f"{label:>20}: median {statistics.median(timings):.2f}ms "
+                    f"max {max(timings):.2f}ms, of which SQL median "
+                    f"{statistics.median(sql_timings):.2f}ms")
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    def seed(self, items, slots):
+        self.stdout.write(f"Seeding {items} items and {slots} slots...")
+        rng = random.Random(0)
+
+        Item.objects.bulk_create((
+            Item(
+                name=f"{BENCH_PREFIX} {rng.choice(BRANDS)} "
+                     f"{rng.choice(FLAVORS)} {index}",
+                volume=rng.choice(['0.25', '0.33', '0.50', '1.00']),
+                price=f"{rng.uniform(0.25, 3):.2f}",
+            ) for index in range(items)
+        ), batch_size=5000)
+
+        item_ids = list(Item.objects.filter(
+            name__startswith=BENCH_PREFIX).values_list('id', flat=True))
+
+        MachineItem.objects.bulk_create((
+            MachineItem(
+                item_id=rng.choice(item_ids),
+                count=(rng.randint(0, MAX_MACHINE_ITEMS - 1)
+                       if rng.random() < LOW_STOCK_RATIO
+                       else MAX_MACHINE_ITEMS))
+            for _ in range(slots)
+        ), batch_size=10000)
+
+        # Give the planner fresh statistics, as autovacuum would
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def time_request(self, params, runs, page_size):
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+        url = reverse('core:inventory-list')
+        params = dict(params, page_size=page_size)
+
+        sql_time = [0]
+
+        def time_sql(execute, sql, sql_params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, sql_params, many, context)
+            finally:
+                sql_time[0] += time.perf_counter() - start
+
+        timings = []
+        sql_timings = []
+        for _ in range(runs):
+            sql_time[0] = 0
+            with connection.execute_wrapper(time_sql):
+                start = time.perf_counter()
+                response = client.get(url, params)
+                timings.append((time.perf_counter() - start) * 1000)
+            sql_timings.append(sql_time[0] * 1000)
+
+            if response.status_code != 200:
+                raise RuntimeError(
+                    f"Inventory request failed with {response.status_code}")
+        return timings, sql_timings
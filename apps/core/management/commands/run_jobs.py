@@ -0,0 +1,74 @@
+import multiprocessing
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.jobs import enqueue, run_pending
+from core.models import CountShard
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=0,
+            help="Size of the process pool for CPU-bound jobs (0 runs them inline)")
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.JOBS_POLL_INTERVAL,
+            help="Seconds to wait between polls when the queue is empty")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Drain the queue and exit instead of polling forever")
+
+    def periodic_jobs(self):
+        """
+        Returns the jobs this worker enqueues on a schedule, with their
+        interval in seconds.
+        """
+        jobs = {
+            'prune_sync_versions': settings.SYNC_PRUNE_INTERVAL,
+            'prune_jobs': settings.JOBS_PRUNE_INTERVAL,
+        }
+        if settings.COUNTABLE_SHARDS > 1 or CountShard.objects.exists():
+            jobs['compact_counters'] = settings.COUNTABLE_COMPACT_INTERVAL
+        return jobs
+
+    def handle(self, *args, **options):
+        executor = None
+        if options['processes']:
+            # Spawned children don't share the parent's DB connections
+            executor = ProcessPoolExecutor(
+                max_workers=options['processes'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+
+        last_enqueued = {}
+
+        try:
+            while True:
+                for name, interval in self.periodic_jobs().items():
+                    now = time.monotonic()
+                    if now - last_enqueued.get(name, -interval) >= interval:
+                        enqueue(name)
+                        last_enqueued[name] = now
+
+                ran = run_pending(
+                    executor=executor,
+                    concurrency=max(options['processes'], 1))
+                if ran:
+                    self.stdout.write(f"Ran {ran} job(s)")
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if executor is not None:
+                executor.shutdown()
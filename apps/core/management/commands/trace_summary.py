@@ -0,0 +1,82 @@
+import json
+import math
+import os
+
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Summarizes the slowest endpoints, SQL statements and stacks from recorded traces"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=str(settings.TRACING_FILE))
+        parser.add_argument('--top', type=int, default=10)
+
+    def handle(self, *args, **options):
+        endpoints = defaultdict(list)
+        statements = defaultdict(list)
+        plans = {}
+        stacks = Counter()
+
+        for trace in self.read_traces(options['file']):
+            other = trace['otherData']
+            for event in trace['traceEvents']:
+                if event['cat'] == 'view':
+                    endpoints[other['endpoint']].append(event['dur'])
+                elif event['cat'] == 'sql':
+                    sql = event['args']['sql']
+                    statements[sql].append(event['dur'])
+                    if 'plan' in event['args']:
+                        plans[sql] = event['args']['plan']
+            stacks.update(other['stacks'])
+
+        if not endpoints:
+            self.stdout.write("No traces found")
+            return
+
+        top = options['top']
+
+        self.stdout.write("Slowest endpoints (ms):")
+        for name, durations in self.slowest(endpoints, top):
+            self.stdout.write(self.format_row(name, durations))
+
+        self.stdout.write("\nSlowest SQL statements (ms):")
+        for sql, durations in self.slowest(statements, top):
+            self.stdout.write(self.format_row(sql, durations))
+            for line in plans.get(sql, []):
+                self.stdout.write(f"      {line}")
+
+        self.stdout.write("\nHottest stacks (samples):")
+        for stack, samples in stacks.most_common(top):
+            # The innermost frames are the interesting ones
+            leaf = ';'.join(stack.split(';')[-3:])
+            self.stdout.write(f"  {samples:>6}  {leaf}")
+
+    def read_traces(self, path):
+        paths = [f"{path}.{index}" for index in range(
+            settings.TRACING_BACKUP_COUNT, 0, -1)] + [path]
+
+        for trace_path in paths:
+            if not os.path.exists(trace_path):
+                continue
+            with open(trace_path) as trace_file:
+                for line in trace_file:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def slowest(self, durations_by_name, top):
+        return sorted(
+            durations_by_name.items(),
+            key=lambda item: sum(item[1]) / len(item[1]),
+            reverse=True)[:top]
+
+    def format_row(self, name, durations):
+        durations = sorted(durations)
+        mean = sum(durations) / len(durations) / 1000
+        p95 = durations[max(0, math.ceil(len(durations) * 0.95) - 1)] / 1000
+        return (
+            f"  {name}\n    count={len(durations)} mean={mean:.2f} "
+            f"p95={p95:.2f} max={durations[-1] / 1000:.2f}")
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_auto_20210921_0017'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='coinsamount',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='machineitem',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+    ]
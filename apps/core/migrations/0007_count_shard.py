@@ -0,0 +1,28 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counter_type', models.CharField(max_length=64)),
+                ('counter_id', models.CharField(max_length=64)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('delta', models.IntegerField(default=0)),
+                ('version', models.BigIntegerField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='countshard',
+            constraint=models.UniqueConstraint(fields=('counter_type', 'counter_id', 'shard'), name='unique_count_shard'),
+        ),
+    ]
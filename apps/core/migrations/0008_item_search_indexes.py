@@ -0,0 +1,104 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:11
+
+import sqlite3
+
+from django.db import migrations, models
+
+
+SQLITE_SEARCH_SQL = [
+    """
+    CREATE VIRTUAL TABLE core_item_fts USING fts5(
+        name, content='core_item', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    "INSERT INTO core_item_fts(core_item_fts) VALUES ('rebuild')",
+    """
+    CREATE TRIGGER core_item_fts_insert AFTER INSERT ON core_item BEGIN
+        INSERT INTO core_item_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER core_item_fts_delete AFTER DELETE ON core_item BEGIN
+        INSERT INTO core_item_fts(core_item_fts, rowid, name)
+        VALUES ('delete', old.id, old.name);
+    END
+    """,
+    """
+    CREATE TRIGGER core_item_fts_update AFTER UPDATE OF name ON core_item BEGIN
+        INSERT INTO core_item_fts(core_item_fts, rowid, name)
+        VALUES ('delete', old.id, old.name);
+        INSERT INTO core_item_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+]
+
+SQLITE_DROP_SEARCH_SQL = [
+    "DROP TRIGGER IF EXISTS core_item_fts_insert",
+    "DROP TRIGGER IF EXISTS core_item_fts_delete",
+    "DROP TRIGGER IF EXISTS core_item_fts_update",
+    "DROP TABLE IF EXISTS core_item_fts",
+]
+
+POSTGRES_SEARCH_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Django's icontains/istartswith compare UPPER(name) on Postgres
+    """
+    CREATE INDEX core_item_name_trgm_idx
+    ON core_item USING gin (UPPER(name) gin_trgm_ops)
+    """,
+]
+
+POSTGRES_DROP_SEARCH_SQL = [
+    "DROP INDEX IF EXISTS core_item_name_trgm_idx",
+]
+
+
+def run_for_vendor(schema_editor, statements_by_vendor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite' and sqlite3.sqlite_version_info < (3, 34, 0):
+        # No trigram tokenizer, name filters fall back to plain LIKE
+        return
+
+    for statement in statements_by_vendor.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_search_indexes(apps, schema_editor):
+    run_for_vendor(schema_editor, {
+        'sqlite': SQLITE_SEARCH_SQL,
+        'postgresql': POSTGRES_SEARCH_SQL,
+    })
+
+
+def drop_search_indexes(apps, schema_editor):
+    run_for_vendor(schema_editor, {
+        'sqlite': SQLITE_DROP_SEARCH_SQL,
+        'postgresql': POSTGRES_DROP_SEARCH_SQL,
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_count_shard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['name'], name='core_item_name_de2dec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['price'], name='core_item_price_1e417b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['volume'], name='core_item_volume_1eaea1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='machineitem',
+            index=models.Index(fields=['item', 'count'], name='core_machin_item_id_8706ad_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_sync_watermark'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='machineitem',
+            index=models.Index(fields=['count'], name='core_machin_count_b49812_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:34
+
+from importlib import import_module
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+search_indexes = import_module('core.migrations.0008_item_search_indexes')
+
+
+# SQLite adds a column by rebuilding the table, which drops the FTS triggers
+def drop_sqlite_search_index(apps, schema_editor):
+    search_indexes.run_for_vendor(schema_editor, {
+        'sqlite': search_indexes.SQLITE_DROP_SEARCH_SQL,
+    })
+
+
+def create_sqlite_search_index(apps, schema_editor):
+    search_indexes.run_for_vendor(schema_editor, {
+        'sqlite': search_indexes.SQLITE_SEARCH_SQL,
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_machineitem_count_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot_id', models.BigIntegerField()),
+                ('version', models.BigIntegerField(db_index=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(
+            drop_sqlite_search_index, create_sqlite_search_index),
+        migrations.AddField(
+            model_name='item',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(
+            create_sqlite_search_index, drop_sqlite_search_index),
+        migrations.AddField(
+            model_name='syncwatermark',
+            name='tombstones_pruned_to',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:37
+
+from django.db import migrations
+
+
+NAME_PREFIX_INDEX_SQL = {
+    # SQLite only turns LIKE 'term%' into an index range on NOCASE columns
+    'sqlite': [
+        """
+        CREATE INDEX core_item_name_nocase_idx
+        ON core_item (name COLLATE NOCASE)
+        """,
+    ],
+    # Django's istartswith compares UPPER(name) with LIKE on Postgres, which
+    # only a pattern ops index can serve whatever the collation
+    'postgresql': [
+        """
+        CREATE INDEX core_item_name_upper_prefix_idx
+        ON core_item (UPPER(name) text_pattern_ops)
+        """,
+    ],
+}
+
+DROP_NAME_PREFIX_INDEX_SQL = {
+    'sqlite': ["DROP INDEX IF EXISTS core_item_name_nocase_idx"],
+    'postgresql': ["DROP INDEX IF EXISTS core_item_name_upper_prefix_idx"],
+}
+
+
+def create_name_prefix_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for statement in NAME_PREFIX_INDEX_SQL.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_name_prefix_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for statement in DROP_NAME_PREFIX_INDEX_SQL.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_sync_tombstones'),
+    ]
+
+    operations = [
+        # A plain index on name can serve neither UPPER(name) LIKE on
+        # Postgres nor the case-insensitive LIKE of SQLite
+        migrations.RemoveIndex(
+            model_name='item',
+            name='core_item_name_de2dec_idx',
+        ),
+        migrations.RunPython(create_name_prefix_index, drop_name_prefix_index),
+    ]
@@ -1,28 +1,224 @@
-from django.db import models
+import random
+import sqlite3
 
+from django.conf import settings
+from django.db import connection, IntegrityError, models, transaction
+from django.db.models import CharField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
 
-class Countable(models.Model):
+
+def next_sync_version():
+    """
+    Returns the sync version of the current transaction, allocating it on its
+    first write. Every row a transaction writes shares that version, which
+    only becomes visible when the transaction commits.
+    """
+    from core.models import SyncVersion
+
+    if not connection.in_atomic_block:
+        return SyncVersion.objects.create().pk
+
+    # Django drops on_commit callbacks once their transaction, or the
+    # savepoint they were registered in, ends. A marker still pending means
+    # we are in the transaction that allocated the version.
+    marker, version = getattr(connection, 'sync_version', (None, None))
+    if any(func is marker for _, func in connection.run_on_commit):
+        return version
+
+    version = SyncVersion.objects.create().pk
+
+    def marker():
+        pass
+
+    transaction.on_commit(marker)
+    connection.sync_version = (marker, version)
+    return version
+
+
+def can_return_from_update():
+    """
+    Whether the database can return the rows an UPDATE changed.
+    """
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 35, 0)
+    return connection.vendor == 'postgresql'
+
+
+def shard_total(model):
+    """
+    Subquery expression summing the shard deltas of each row of `model`.
+    """
+    from core.models import CountShard
+
+    shards = CountShard.objects.filter(
+        counter_type=model._meta.label_lower,
+        counter_id=Cast(OuterRef('pk'), CharField()),
+    ).values('counter_id').annotate(total=Sum('delta')).values('total')
+
+    return Coalesce(Subquery(shards), 0)
+
+
+class Versioned(models.Model):
+    version = models.BigIntegerField(default=0, db_index=True)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            self.version = next_sync_version()
+            super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+class Countable(Versioned):
     count = models.IntegerField(default=0)
 
+    # Hot counters can spread their writes over CountShard rows, see
+    # COUNTABLE_SHARDS. `count` then only holds the compacted base value.
+    # Shards left behind when sharding is turned off count again once
+    # compact_counters folds them, run_jobs schedules it while any exist.
+    shardable = False
+
+    @property
+    def is_sharded(self):
+        return self.shardable and settings.COUNTABLE_SHARDS > 1
+
+    def get_count(self):
+        if not self.is_sharded:
+            return self.count
+
+        # Base and shards are read in one statement so a concurrent
+        # compaction can't be counted twice
+        return type(self).objects.filter(pk=self.pk).annotate(
+            total=F('count') + shard_total(type(self))
+        ).values_list('total', flat=True).get()
+
     def reset_count(self):
-        prev_count = self.count
+        if self.is_sharded:
+            return self._reset_sharded_count()
+
+        with transaction.atomic(savepoint=False):
+            prev_count = type(self).objects.select_for_update().filter(
+                pk=self.pk).values_list('count', flat=True).get()
+            self._write_count(0)
+
         self.count = 0
-        self.save()
         return prev_count
 
     def add_to_count(self, to_add_value):
-        prev_count = self.count
-        new_count = prev_count + to_add_value
-        self.count = new_count
-        self.save()
-        return prev_count, new_count
+        if self.is_sharded:
+            return self._add_to_shard(to_add_value)
+
+        return self._add_to_base_count(to_add_value)
 
     def subtract_to_count(self, to_subtract_value):
-        prev_count = self.count
-        new_count = prev_count - to_subtract_value
+        if self.is_sharded:
+            return self._add_to_shard(-to_subtract_value)
+
+        return self._add_to_base_count(-to_subtract_value)
+
+    def _add_to_base_count(self, delta):
+        with transaction.atomic(savepoint=False):
+            if can_return_from_update():
+                new_count = self._add_returning_count(delta)
+            else:
+                self._write_count(F('count') + delta)
+                new_count = type(self).objects.filter(
+                    pk=self.pk).values_list('count', flat=True).get()
+
         self.count = new_count
-        self.save()
-        return prev_count, new_count
+        return new_count - delta, new_count
+
+    def _add_returning_count(self, delta):
+        """
+        Adds `delta` and reads the new count back in a single statement.
+        """
+        self.version = next_sync_version()
+        quote_name = connection.ops.quote_name
+        count_column = quote_name(self._meta.get_field('count').column)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {quote_name(self._meta.db_table)} "
+                f"SET {count_column} = {count_column} + %s, "
+                f"{quote_name(self._meta.get_field('version').column)} = %s "
+                f"WHERE {quote_name(self._meta.pk.column)} = %s "
+                f"RETURNING {count_column}",
+                [int(delta), self.version,
+                 self._meta.pk.get_db_prep_value(self.pk, connection)])
+            return cursor.fetchone()[0]
+
+    def _write_count(self, count):
+        self.version = next_sync_version()
+        type(self).objects.filter(pk=self.pk).update(
+            count=count, version=self.version)
+
+    def compact_count(self):
+        """
+        Folds the shard deltas into the base count. Returns the new count.
+        """
+        from core.models import CountShard
+
+        with transaction.atomic(savepoint=False):
+            locked = type(self).objects.select_for_update().get(pk=self.pk)
+            shards = list(CountShard.objects.select_for_update().filter(
+                counter_type=self._meta.label_lower, counter_id=str(self.pk)))
+
+            if shards:
+                locked.count += sum(shard.delta for shard in shards)
+                CountShard.objects.filter(
+                    pk__in=[shard.pk for shard in shards]).delete()
+                locked.save()
+
+        self.count = locked.count
+        self.version = locked.version
+        return self.count
+
+    def _add_to_shard(self, delta):
+        from core.models import CountShard
+
+        shard = random.randrange(settings.COUNTABLE_SHARDS)
+        shards = CountShard.objects.filter(
+            counter_type=self._meta.label_lower, counter_id=str(self.pk),
+            shard=shard)
+
+        with transaction.atomic(savepoint=False):
+            version = next_sync_version()
+
+            # Compaction may delete the shard and another writer may create
+            # it at any point, so retry until one of the writes lands
+            while not shards.update(delta=F('delta') + delta, version=version):
+                try:
+                    with transaction.atomic():
+                        CountShard.objects.create(
+                            counter_type=self._meta.label_lower,
+                            counter_id=str(self.pk), shard=shard,
+                            delta=delta, version=version)
+                    break
+                except IntegrityError:
+                    pass
+
+        new_count = self.get_count()
+        return new_count - delta, new_count
+
+    def _reset_sharded_count(self):
+        from core.models import CountShard
+
+        with transaction.atomic(savepoint=False):
+            locked = type(self).objects.select_for_update().get(pk=self.pk)
+            shards = list(CountShard.objects.select_for_update().filter(
+                counter_type=self._meta.label_lower, counter_id=str(self.pk)))
+
+            prev_count = locked.count + sum(shard.delta for shard in shards)
+
+            CountShard.objects.filter(
+                pk__in=[shard.pk for shard in shards]).delete()
+            locked.count = 0
+            locked.save()
+
+        self.count = 0
+        self.version = locked.version
+        return prev_count
 
     class Meta:
         abstract = True
@@ -1,24 +1,88 @@
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.utils import timezone
 
-from core.mixins import Countable
+from core.mixins import Countable, Versioned
 
 # Create your models here.
 
 
+class SyncVersion(models.Model):
+    """
+    Monotonic source of sync versions. Each writing transaction inserts a row
+    and stamps its id on the rows it writes, so machines can ask for
+    everything changed since the last version they acknowledged. Rows at or
+    below the watermark are pruned.
+    """
+    created_at = models.DateTimeField(default=timezone.now)
+
+
+class SyncWatermark(models.Model):
+    """
+    Highest sync version below which every write is known to be committed
+    or abandoned. It's the version machines are told to acknowledge.
+    """
+    version = models.BigIntegerField(default=0)
+    # Tombstones up to this version were pruned, machines behind it need a
+    # full snapshot
+    tombstones_pruned_to = models.BigIntegerField(default=0)
+
+
+class SyncTombstone(models.Model):
+    """
+    Records a deleted machine slot, so the deletion reaches machines in their
+    next delta.
+    """
+    slot_id = models.BigIntegerField()
+    version = models.BigIntegerField(db_index=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+
+class CountShard(models.Model):
+    """
+    One slice of a sharded Countable. Writers add to a random shard and
+    readers sum them on top of the row's base count.
+    """
+    counter_type = models.CharField(max_length=64)
+    counter_id = models.CharField(max_length=64)
+    shard = models.PositiveSmallIntegerField()
+    delta = models.IntegerField(default=0)
+    version = models.BigIntegerField(default=0, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['counter_type', 'counter_id', 'shard'],
+                name='unique_count_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.counter_type}:{self.counter_id}[{self.shard}] - {self.delta}"
+
+
 class CoinsAmount(Countable, models.Model):
     id = models.CharField(max_length=10, primary_key=True)
     value = models.DecimalField(max_digits=6, decimal_places=3)
 
+    shardable = True
+
     def __str__(self):
         return f"{self.value} - {self.count}"
 
 
-class Item(models.Model):
+class Item(Versioned, models.Model):
     name = models.CharField(max_length=64)
     volume = models.DecimalField(max_digits=3, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=3)
 
+    class Meta:
+        # Name search is backed by the trigram/FTS5 indexes of migration
+        # 0008, name prefixes by the case-insensitive index of migration 0012
+        indexes = [
+            models.Index(fields=['price']),
+            models.Index(fields=['volume']),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.volume}L - ${self.price}"
 
@@ -36,5 +100,48 @@ class MachineItem(Countable, models.Model):
         ]
     )
 
+    class Meta:
+        # `count` serves the low stock filter on its own, while `item, count`
+        # serves it combined with item filters, joined through the item id
+        indexes = [
+            models.Index(fields=['count']),
+            models.Index(fields=['item', 'count']),
+        ]
+
     def __str__(self):
         return f"{self.item} - {self.count}"
+
+
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    priority = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} - {self.status}"
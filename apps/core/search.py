@@ -0,0 +1,55 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+
+ITEM_FTS_TABLE = 'core_item_fts'
+
+# Trigram indexes can't narrow down terms shorter than a trigram
+MIN_INDEXED_TERM_LENGTH = 3
+
+
+def uses_item_fts():
+    """
+    Returns whether the FTS5 trigram table exists on this connection.
+    Migration 0008 only creates it when the SQLite library supports trigrams,
+    so its presence is checked, once per connection.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+
+    exists = getattr(connection, 'item_fts_exists', None)
+    if exists is None:
+        exists = ITEM_FTS_TABLE in connection.introspection.table_names()
+        connection.item_fts_exists = exists
+    return exists
+
+
+def item_ids_containing(term):
+    """
+    Subquery of the ids of the items whose name contains `term`, answered by
+    the FTS5 trigram table.
+    """
+    phrase = '"%s"' % term.replace('"', '""')
+    return RawSQL(
+        f"SELECT rowid FROM {ITEM_FTS_TABLE} WHERE {ITEM_FTS_TABLE} MATCH %s",
+        [phrase])
+
+
+def filter_by_item_name(queryset, item_field, lookup, term):
+    """
+    Filters `queryset` by an `icontains` or `istartswith` lookup on the item
+    name reached through `item_field`.
+
+    Prefixes are served by the case-insensitive name index on both
+    databases. On Postgres `icontains` is served by the trigram GIN index on
+    UPPER(name), while on SQLite the FTS5 table narrows the candidates down
+    first and the lookup only checks those.
+    """
+    queryset = queryset.filter(**{f'{item_field}name__{lookup}': term})
+
+    if (lookup == 'icontains' and uses_item_fts() and
+            len(term) >= MIN_INDEXED_TERM_LENGTH):
+        queryset = queryset.filter(
+            **{f'{item_field}id__in': item_ids_containing(term)})
+
+    return queryset
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from core.models import CoinsAmount, Item, MachineItem
+from core.models import CoinsAmount, Item, Job, MachineItem
 
 
 class CoinsAmountSerializer(serializers.Serializer):
@@ -19,3 +19,22 @@ class MachineItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = MachineItem
         fields = ['id', 'item', 'count']
+
+
+class VendSerializer(serializers.Serializer):
+    id = serializers.IntegerField(required=True)
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class SyncSerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0, default=0)
+    vends = VendSerializer(many=True, default=list)
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'name', 'status', 'priority', 'attempts', 'result',
+            'error', 'created_at', 'updated_at'
+        ]
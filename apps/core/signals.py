@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from core.mixins import next_sync_version
+from core.models import MachineItem, SyncTombstone
+
+
+@receiver(post_delete, sender=MachineItem)
+def record_slot_deletion(sender, instance, **kwargs):
+    SyncTombstone.objects.create(
+        slot_id=instance.pk, version=next_sync_version())
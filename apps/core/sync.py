@@ -0,0 +1,160 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.mixins import next_sync_version, shard_total
+from core.models import (
+    CoinsAmount, CountShard, MachineItem, SyncTombstone, SyncVersion,
+    SyncWatermark)
+
+
+def committed_sync_version():
+    """
+    Advances and returns the sync watermark, the highest version V such that
+    every write stamped with a version up to V is visible.
+
+    Versions are allocated inside the transaction of the write they stamp, so
+    a missing id is a write still in flight, unless a later version was
+    already allocated more than SYNC_IN_FLIGHT_TIMEOUT seconds ago, in which
+    case it was rolled back. Rows up to the watermark are pruned on the way.
+    """
+    watermark = SyncWatermark.objects.get_or_create(pk=1)[0].version
+    cutoff = timezone.now() - timedelta(
+        seconds=settings.SYNC_IN_FLIGHT_TIMEOUT)
+
+    versions = SyncVersion.objects.filter(
+        pk__gt=watermark).order_by('id').values_list('id', 'created_at')
+
+    for version, created_at in versions.iterator():
+        if version != watermark + 1 and created_at > cutoff:
+            break
+        watermark = version
+
+    SyncWatermark.objects.filter(
+        pk=1, version__lt=watermark).update(version=watermark)
+    SyncVersion.objects.filter(pk__lte=watermark).delete()
+
+    return watermark
+
+
+def apply_vends(vends):
+    """
+    Applies the vends a machine recorded while offline, in bulk.
+
+    The server stock is authoritative: each slot serves at most its current
+    count, and whatever could not be served is returned as rejected so the
+    machine can reconcile its local state.
+    """
+    quantities = defaultdict(int)
+    for vend in vends:
+        quantities[vend['id']] += vend['quantity']
+
+    rejected = []
+    if not quantities:
+        return rejected
+
+    with transaction.atomic():
+        machine_items = MachineItem.objects.select_for_update().filter(
+            pk__in=quantities)
+
+        version = next_sync_version()
+        updated = []
+
+        for machine_item in machine_items:
+            wanted = quantities.pop(machine_item.pk)
+            served = min(wanted, machine_item.count)
+
+            if served < wanted:
+                rejected.append([machine_item.pk, wanted - served])
+
+            if served:
+                machine_item.count -= served
+                machine_item.version = version
+                updated.append(machine_item)
+
+        MachineItem.objects.bulk_update(updated, ['count', 'version'])
+
+    # Slots the server doesn't know about can't be served at all
+    rejected.extend([pk, quantity] for pk, quantity in quantities.items())
+    return rejected
+
+
+def prune_tombstones():
+    """
+    Deletes slot tombstones older than SYNC_TOMBSTONE_RETENTION seconds, and
+    records the highest pruned version so machines behind it get a snapshot.
+    """
+    cutoff = timezone.now() - timedelta(
+        seconds=settings.SYNC_TOMBSTONE_RETENTION)
+
+    with transaction.atomic():
+        expired = SyncTombstone.objects.filter(created_at__lt=cutoff)
+        pruned_to = max(expired.values_list('version', flat=True), default=0)
+
+        SyncWatermark.objects.get_or_create(pk=1)
+        SyncWatermark.objects.filter(
+            pk=1, tombstones_pruned_to__lt=pruned_to
+        ).update(tombstones_pruned_to=pruned_to)
+        expired.delete()
+
+    return pruned_to
+
+
+def changes_since(since):
+    """
+    Returns the slots, coin counts and deleted slot ids changed after the
+    `since` version. Slots are compact `[id, item_id, price, count]` rows, so
+    item and price changes reach machines along with the counts.
+
+    The returned version is the committed watermark, so changes still in
+    flight are sent again on the next sync. Rows are absolute, so machines
+    can apply a repeated one as is.
+
+    A first sync (`since` 0), or one from behind the pruned tombstones, gets
+    a full snapshot instead: every slot and coin counter, flagged with
+    `snapshot` so the machine drops whatever slot it isn't sent.
+    """
+    version = committed_sync_version()
+    pruned_to = SyncWatermark.objects.get(pk=1).tombstones_pruned_to
+    snapshot = since == 0 or since < pruned_to
+
+    items = MachineItem.objects.all()
+    coins = CoinsAmount.objects.all()
+    deleted = SyncTombstone.objects.none()
+
+    if not snapshot:
+        # A slot also changes when its item does, e.g. on a price update
+        items = items.filter(
+            Q(version__gt=since) | Q(item__version__gt=since))
+
+        # Sharded coin writes only touch their shard, so its version counts
+        changed_shards = CountShard.objects.filter(
+            counter_type=CoinsAmount._meta.label_lower, version__gt=since
+        ).values('counter_id')
+        coins = coins.filter(
+            Q(version__gt=since) | Q(pk__in=changed_shards))
+
+        deleted = SyncTombstone.objects.filter(version__gt=since)
+
+    items = items.order_by('id').values_list(
+        'id', 'item_id', 'item__price', 'count')
+    coins = coins.annotate(
+        total=F('count') + shard_total(CoinsAmount)
+    ).order_by('id').values_list('id', 'total')
+    deleted = deleted.order_by('slot_id').values_list(
+        'slot_id', flat=True).distinct()
+
+    return {
+        'version': version,
+        'snapshot': snapshot,
+        'items': [
+            [pk, item_id, str(price), count]
+            for pk, item_id, price, count in items
+        ],
+        'coins': [list(row) for row in coins],
+        'deleted': list(deleted),
+    }
@@ -1,21 +1,57 @@
+import json
+import multiprocessing
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+import django
+
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
 from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 
-from core.models import CoinsAmount, Item, MachineItem, MAX_MACHINE_ITEMS
+from core.jobs import (
+    compact_counters, enqueue, job, prune_jobs, run_pending)
+from core.models import (
+    CoinsAmount, CountShard, Item, Job, MachineItem, MAX_MACHINE_ITEMS,
+    SyncTombstone, SyncVersion)
+from core.sync import committed_sync_version, prune_tombstones
 
 
 class InventoryTests(APITestCase):
     def test_list_inventory(self):
         """
-        Ensure we can list all inventory items.
+        Ensure we can list all inventory items, in a page.
         """
+        item = Item.objects.create(
+            name='Coke', volume=0.25, price=0.5)
+        machine_item = MachineItem.objects.create(item=item, count=5)
+
         url = reverse('core:inventory-list')
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+        self.assertEqual(
+            set(response.data), {'next', 'previous', 'results'})
+        self.assertEqual(response.data['results'], [{
+            'id': machine_item.id,
+            'item': {
+                'id': item.id, 'name': 'Coke', 'volume': '0.25',
+                'price': '0.500',
+            },
+            'count': 5,
+        }])
+
     def test_buy_item_ok(self):
         """
         Ensure we can buy an item.
@@ -98,6 +134,9 @@ class InventoryTests(APITestCase):
         url = reverse('core:inventory-refill')
         response = self.client.post(url, {}, format='json')
 
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(run_pending(), 1)
+
         new_machine_item1 = MachineItem.objects.get(id=machine_item1.id)
         new_machine_item2 = MachineItem.objects.get(id=machine_item2.id)
         new_machine_item3 = MachineItem.objects.get(id=machine_item3.id)
@@ -105,7 +144,233 @@ class InventoryTests(APITestCase):
         self.assertEqual(new_machine_item1.count, MAX_MACHINE_ITEMS)
         self.assertEqual(new_machine_item2.count, MAX_MACHINE_ITEMS)
         self.assertEqual(new_machine_item3.count, MAX_MACHINE_ITEMS)
+
+        url = reverse('core:jobs-detail', kwargs={'pk': response.data['id']})
+        response = self.client.get(url, format='json')
+
+        self.assertEqual(response.data['status'], Job.DONE)
+        self.assertEqual(response.data['result'], {'refilled': 3})
+
+
+class InventoryFilterTests(APITestCase):
+    def setUp(self):
+        coke = Item.objects.create(
+            name='Coca-Cola', volume=0.5, price=1.5)
+        coke_zero = Item.objects.create(
+            name='Coca-Cola Zero', volume=0.25, price=1)
+        sprite = Item.objects.create(
+            name='Sprite', volume=0.25, price=0.5)
+
+        self.coke_slot = MachineItem.objects.create(item=coke, count=5)
+        self.coke_zero_slot = MachineItem.objects.create(
+            item=coke_zero, count=1)
+        self.sprite_slot = MachineItem.objects.create(item=sprite, count=0)
+
+    def get_ids(self, params, url_name='core:inventory-list'):
+        response = self.client.get(reverse(url_name), params, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['id'] for row in response.data['results']]
+
+    def test_filter_by_name_prefix(self):
+        """
+        Ensure slots can be filtered by item name prefix.
+        """
+        self.assertEqual(
+            self.get_ids({'name': 'coca'}),
+            [self.coke_slot.id, self.coke_zero_slot.id])
+        self.assertEqual(self.get_ids({'name': 'zero'}), [])
+
+    def test_search_by_name(self):
+        """
+        Ensure slots can be searched anywhere in the item name.
+        """
+        self.assertEqual(
+            self.get_ids({'search': 'ZERO'}), [self.coke_zero_slot.id])
+        self.assertEqual(
+            self.get_ids({'search': 'ri'}), [self.sprite_slot.id])
+
+    def test_search_follows_renamed_items(self):
+        """
+        Ensure the search index is kept in sync with item names.
+        """
+        Item.objects.filter(name='Sprite').update(name='Fanta')
+
+        self.assertEqual(self.get_ids({'search': 'sprite'}), [])
+        self.assertEqual(
+            self.get_ids({'search': 'fanta'}), [self.sprite_slot.id])
+
+    def test_search_without_fts_table(self):
+        """
+        Ensure search falls back to plain lookups without the FTS5 table.
+        """
+        exists = getattr(connection, 'item_fts_exists', None)
+        connection.item_fts_exists = False
+        try:
+            self.assertEqual(
+                self.get_ids({'search': 'zero'}), [self.coke_zero_slot.id])
+        finally:
+            connection.item_fts_exists = exists
+
+    def test_filter_by_price_volume_and_stock(self):
+        """
+        Ensure slots can be filtered by price range, volume and low stock.
+        """
+        self.assertEqual(
+            self.get_ids({'min_price': 0.75, 'max_price': 1.25}),
+            [self.coke_zero_slot.id])
+        self.assertEqual(
+            self.get_ids({'volume': 0.25}),
+            [self.coke_zero_slot.id, self.sprite_slot.id])
+        self.assertEqual(
+            self.get_ids({'low_stock': 1}),
+            [self.coke_zero_slot.id, self.sprite_slot.id])
+
+    def test_inventory_is_paginated(self):
+        """
+        Ensure the inventory is served in pages ordered by id.
+        """
+        url = reverse('core:inventory-list')
+        response = self.client.get(url, {'page_size': 2}, format='json')
+
+        self.assertEqual(
+            [row['id'] for row in response.data['results']],
+            [self.coke_slot.id, self.coke_zero_slot.id])
+
+        response = self.client.get(response.data['next'], format='json')
+
+        self.assertEqual(
+            [row['id'] for row in response.data['results']],
+            [self.sprite_slot.id])
+        self.assertIsNone(response.data['next'])
+
+    def test_filter_items(self):
+        """
+        Ensure items can be filtered too.
+        """
+        ids = self.get_ids(
+            {'search': 'cola', 'max_price': 1}, url_name='core:items-list')
+
+        self.assertEqual(ids, [self.coke_zero_slot.item_id])
+
+
+@job('test_flaky')
+def flaky(payload):
+    raise RuntimeError("Flaky job")
+
+
+recorded = []
+
+
+@job('test_record')
+def record(payload):
+    recorded.append(payload['name'])
+
+
+@job('test_cpu_bound', cpu_bound=True)
+def cpu_bound(payload):
+    start = time.time()
+    total = sum(i * i for i in range(payload['n']))
+    time.sleep(payload.get('sleep', 0))
+    return {'total': total, 'start': start, 'end': time.time()}
+
+
+class JobsTests(APITestCase):
+    def test_jobs_run_by_priority(self):
+        """
+        Ensure higher priority jobs are run first.
+        """
+        self.addCleanup(recorded.clear)
+
+        enqueue('test_record', {'name': 'low'}, priority=0)
+        enqueue('test_record', {'name': 'high'}, priority=10)
+
+        self.assertEqual(run_pending(), 2)
+        self.assertEqual(recorded, ['high', 'low'])
+
+    def test_failed_job_is_retried(self):
+        """
+        Ensure failing jobs are retried until they run out of attempts.
+        """
+        flaky_job = enqueue('test_flaky', max_attempts=2)
+
+        run_pending()
+        flaky_job.refresh_from_db()
+
+        self.assertEqual(flaky_job.status, Job.PENDING)
+        self.assertEqual(flaky_job.attempts, 1)
+
+        Job.objects.filter(pk=flaky_job.pk).update(run_after=timezone.now())
+        run_pending()
+        flaky_job.refresh_from_db()
+
+        self.assertEqual(flaky_job.status, Job.FAILED)
+        self.assertEqual(flaky_job.attempts, 2)
+        self.assertIn("Flaky job", flaky_job.error)
+
+    def test_finished_jobs_are_pruned(self):
+        """
+        Ensure finished jobs are deleted once past their retention.
+        """
+        old_job = enqueue('test_record', {'name': 'old'})
+        new_job = enqueue('test_record', {'name': 'new'})
+        pending_job = enqueue('test_flaky')
+        self.addCleanup(recorded.clear)
+
+        run_pending()
+        Job.objects.filter(pk__in=[old_job.pk, pending_job.pk]).update(
+            updated_at=timezone.now() - timedelta(
+                seconds=settings.JOBS_RETENTION + 1))
+
+        self.assertEqual(prune_jobs({}), {'pruned': 1})
+        self.assertEqual(
+            set(Job.objects.values_list('pk', flat=True)),
+            {new_job.pk, pending_job.pk})
+
+    def test_expired_lease_is_reclaimed(self):
+        """
+        Ensure jobs left running by a dead worker are retried.
+        """
+        stuck_job = enqueue('refill')
+        Job.objects.filter(pk=stuck_job.pk).update(
+            status=Job.RUNNING, attempts=1,
+            updated_at=timezone.now() - timedelta(
+                seconds=settings.JOBS_LEASE_TIMEOUT + 1))
+
+        self.assertEqual(run_pending(), 1)
+        stuck_job.refresh_from_db()
+
+        self.assertEqual(stuck_job.status, Job.DONE)
+        self.assertEqual(stuck_job.attempts, 2)
+
+    def test_cpu_bound_jobs_run_in_pool(self):
+        """
+        Ensure CPU-bound jobs run concurrently in the process pool.
+        """
+        cpu_jobs = [
+            enqueue('test_cpu_bound', {'n': 1000, 'sleep': 1})
+            for _ in range(2)
+        ]
+
+        executor = ProcessPoolExecutor(
+            max_workers=2, mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup)
+        try:
+            self.assertEqual(
+                run_pending(executor=executor, concurrency=2), 2)
+        finally:
+            executor.shutdown()
+
+        results = []
+        for cpu_job in cpu_jobs:
+            cpu_job.refresh_from_db()
+            self.assertEqual(cpu_job.status, Job.DONE)
+            self.assertEqual(cpu_job.result['total'], 332833500)
+            results.append(cpu_job.result)
+
+        # Both jobs were running at the same time
+        self.assertLess(
+            max(result['start'] for result in results),
+            min(result['end'] for result in results))
 
 
 class CoinsTests(APITestCase):
@@ -152,3 +417,314 @@ class CoinsTests(APITestCase):
         self.assertEqual(int(response.headers['X-Coins']), 3)
         self.assertEqual(new_coins_amount.count, 0)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+# Transactional, since the writes of one transaction share a sync version
+class SyncTests(APITransactionTestCase):
+    # Versions are checked for gaps from the watermark up
+    reset_sequences = True
+
+    def test_sync_returns_changes_since_version(self):
+        """
+        Ensure sync only returns what changed after the acknowledged version.
+        """
+        item = Item.objects.create(
+            name='Coke', volume=0.25, price=0.5)
+
+        machine_item1 = MachineItem.objects.create(item=item, count=5)
+        since = committed_sync_version()
+        machine_item2 = MachineItem.objects.create(item=item, count=3)
+
+        url = reverse('core:sync')
+        response = self.client.post(url, {'since': since}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['snapshot'])
+        self.assertEqual(
+            response.data['items'], [[machine_item2.id, item.id, '0.500', 3]])
+        self.assertEqual(response.data['version'], committed_sync_version())
+
+        response = self.client.post(
+            url, {'since': response.data['version']}, format='json')
+
+        self.assertEqual(response.data['items'], [])
+        self.assertNotEqual(machine_item1.version, machine_item2.version)
+
+    def test_first_sync_is_a_snapshot(self):
+        """
+        Ensure a first sync returns rows written before versioning existed.
+        """
+        item = Item.objects.create(
+            name='Coke', volume=0.25, price=0.5)
+        machine_item = MachineItem.objects.create(item=item, count=5)
+        coins_amount = CoinsAmount.objects.create(
+            id=settings.DEFAULT_COIN_AMOUNT, value='0.25', count=2)
+
+        # As left by the migration that added the version columns
+        MachineItem.objects.update(version=0)
+        CoinsAmount.objects.update(version=0)
+
+        url = reverse('core:sync')
+        response = self.client.post(url, {'since': 0}, format='json')
+
+        self.assertTrue(response.data['snapshot'])
+        self.assertEqual(
+            response.data['items'], [[machine_item.id, item.id, '0.500', 5]])
+        self.assertEqual(response.data['coins'], [[coins_amount.id, 2]])
+
+    def test_sync_reports_deleted_slots_and_item_changes(self):
+        """
+        Ensure deleted slots and price changes reach machines.
+        """
+        item = Item.objects.create(
+            name='Coke', volume=0.25, price=0.5)
+        machine_item1 = MachineItem.objects.create(item=item, count=5)
+        machine_item2 = MachineItem.objects.create(item=item, count=3)
+        since = committed_sync_version()
+
+        machine_item1_id = machine_item1.id
+        machine_item1.delete()
+        item.price = '0.75'
+        item.save()
+
+        url = reverse('core:sync')
+        response = self.client.post(url, {'since': since}, format='json')
+
+        self.assertEqual(response.data['deleted'], [machine_item1_id])
+        self.assertEqual(
+            response.data['items'], [[machine_item2.id, item.id, '0.750', 3]])
+
+        # Behind the pruned tombstones only a snapshot is complete
+        SyncTombstone.objects.update(
+            created_at=timezone.now() - timedelta(
+                seconds=settings.SYNC_TOMBSTONE_RETENTION + 1))
+        prune_tombstones()
+
+        response = self.client.post(url, {'since': since}, format='json')
+
+        self.assertTrue(response.data['snapshot'])
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_vend_allocates_one_sync_version(self):
+        """
+        Ensure every write of a vend shares one sync version.
+        """
+        item = Item.objects.create(
+            name='Coke', volume=0.25, price=0.5)
+        machine_item = MachineItem.objects.create(item=item, count=5)
+        coins_amount = CoinsAmount.objects.create(
+            id=settings.DEFAULT_COIN_AMOUNT, value='0.25', count=3)
+        versions = SyncVersion.objects.count()
+
+        url = reverse('core:inventory-detail', kwargs={'pk': machine_item.id})
+        response = self.client.put(url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(SyncVersion.objects.count(), versions + 1)
+        self.assertEqual(
+            MachineItem.objects.get(id=machine_item.id).version,
+            CoinsAmount.objects.get(id=coins_amount.id).version)
+
+    def test_sync_waits_for_in_flight_versions(self):
+        """
+        Ensure the acknowledged version never skips a write still in flight.
+        """
+        item = Item.objects.create(
+            name='Coke', volume=0.25, price=0.5)
+        since = committed_sync_version()
+
+        machine_item1 = MachineItem.objects.create(item=item, count=5)
+        machine_item2 = MachineItem.objects.create(item=item, count=3)
+        machine_item3 = MachineItem.objects.create(item=item, count=1)
+
+        # Hide the second write's version, as an uncommitted transaction would
+        SyncVersion.objects.filter(pk=machine_item2.version).delete()
+
+        url = reverse('core:sync')
+        response = self.client.post(url, {'since': since}, format='json')
+
+        self.assertEqual(response.data['version'], machine_item1.version)
+        self.assertEqual(len(response.data['items']), 3)
+
+        # Past the timeout the missing version is taken as rolled back
+        SyncVersion.objects.filter(pk=machine_item3.version).update(
+            created_at=timezone.now() - timedelta(
+                seconds=settings.SYNC_IN_FLIGHT_TIMEOUT + 1))
+
+        response = self.client.post(url, {'since': since}, format='json')
+
+        self.assertEqual(response.data['version'], machine_item3.version)
+        self.assertFalse(SyncVersion.objects.exists())
+
+    def test_sync_applies_offline_vends(self):
+        """
+        Ensure offline vends are applied and unservable ones are rejected.
+        """
+        item = Item.objects.create(
+            name='Coke', volume=0.25, price=0.5)
+
+        machine_item1 = MachineItem.objects.create(item=item, count=5)
+        machine_item2 = MachineItem.objects.create(item=item, count=1)
+        since = committed_sync_version()
+
+        vends = [
+            {'id': machine_item1.id, 'quantity': 2},
+            {'id': machine_item2.id, 'quantity': 1},
+            {'id': machine_item2.id, 'quantity': 1},
+        ]
+
+        url = reverse('core:sync')
+        response = self.client.post(
+            url, {'since': since, 'vends': vends}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data['items'],
+            [[machine_item1.id, item.id, '0.500', 3],
+             [machine_item2.id, item.id, '0.500', 0]])
+        self.assertEqual(response.data['rejected'], [[machine_item2.id, 1]])
+        self.assertEqual(MachineItem.objects.get(id=machine_item1.id).count, 3)
+
+    def test_sync_sees_sharded_coins(self):
+        """
+        Ensure sync reports coins changed only through their shards.
+        """
+        coins_amount = CoinsAmount.objects.create(
+            id=settings.DEFAULT_COIN_AMOUNT, value='0.25', count=1)
+        since = committed_sync_version()
+
+        with self.settings(COUNTABLE_SHARDS=4):
+            coins_amount.add_to_count(1)
+
+        url = reverse('core:sync')
+        response = self.client.post(url, {'since': since}, format='json')
+
+        self.assertEqual(response.data['coins'], [[coins_amount.id, 2]])
+
+
+@override_settings(COUNTABLE_SHARDS=4)
+class ShardedCoinsTests(APITestCase):
+    def test_add_coins_to_shards(self):
+        """
+        Ensure sharded coin writes are summed on read.
+        """
+        coins_amount = CoinsAmount.objects.create(
+            id=settings.DEFAULT_COIN_AMOUNT, value='0.25', count=1)
+
+        url = reverse('core:coin')
+        for _ in range(3):
+            response = self.client.put(url, {'coin': 1}, format='json')
+
+        self.assertEqual(int(response.headers['X-Coins']), 4)
+        self.assertEqual(CoinsAmount.objects.get(id=coins_amount.id).count, 1)
+        self.assertTrue(CountShard.objects.exists())
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(int(response.headers['X-Coins']), 4)
+
+    def test_dispense_sharded_coins(self):
+        """
+        Ensure resetting a sharded counter returns and clears every shard.
+        """
+        coins_amount = CoinsAmount.objects.create(
+            id=settings.DEFAULT_COIN_AMOUNT, value='0.25', count=1)
+        coins_amount.add_to_count(2)
+
+        url = reverse('core:coin')
+        response = self.client.delete(url, format='json')
+
+        self.assertEqual(int(response.headers['X-Coins']), 3)
+        self.assertEqual(coins_amount.get_count(), 0)
+        self.assertFalse(CountShard.objects.exists())
+
+    def test_compact_counters(self):
+        """
+        Ensure compaction folds the shards into the base count.
+        """
+        coins_amount = CoinsAmount.objects.create(
+            id=settings.DEFAULT_COIN_AMOUNT, value='0.25', count=1)
+        coins_amount.add_to_count(3)
+        coins_amount.subtract_to_count(1)
+
+        self.assertEqual(compact_counters({}), {'compacted': 1})
+        self.assertFalse(CountShard.objects.exists())
+        self.assertEqual(CoinsAmount.objects.get(id=coins_amount.id).count, 3)
+
+    def test_shards_survive_turning_sharding_off(self):
+        """
+        Ensure shards left behind count once compacted after sharding is
+        turned off.
+        """
+        coins_amount = CoinsAmount.objects.create(
+            id=settings.DEFAULT_COIN_AMOUNT, value='0.25', count=1)
+        coins_amount.add_to_count(3)
+
+        with self.settings(COUNTABLE_SHARDS=0):
+            compact_counters({})
+            coins_amount = CoinsAmount.objects.get(id=coins_amount.id)
+            self.assertEqual(coins_amount.get_count(), 4)
+            self.assertEqual(coins_amount.add_to_count(1), (4, 5))
+            self.assertEqual(coins_amount.reset_count(), 5)
+
+        self.assertFalse(CountShard.objects.exists())
+        self.assertEqual(CoinsAmount.objects.get(id=coins_amount.id).count, 0)
+
+
+class TracingTests(APITestCase):
+    def setUp(self):
+        self.trace_dir = tempfile.TemporaryDirectory()
+        self.trace_file = Path(self.trace_dir.name) / 'traces.jsonl'
+
+    def tearDown(self):
+        self.trace_dir.cleanup()
+
+    def test_sampled_request_is_traced(self):
+        """
+        Ensure sampled requests write a view, serializer and SQL span tree.
+        """
+        item = Item.objects.create(
+            name='Coke', volume=0.25, price=0.5)
+        MachineItem.objects.create(item=item, count=5)
+
+        url = reverse('core:inventory-list')
+        with self.settings(TRACING_SAMPLE_RATE=1, TRACING_EXPLAIN=True,
+                           TRACING_FILE=self.trace_file):
+            response = self.client.get(url, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        trace = json.loads(self.trace_file.read_text().splitlines()[-1])
+        categories = {event['cat'] for event in trace['traceEvents']}
+        sql_events = [
+            event for event in trace['traceEvents'] if event['cat'] == 'sql']
+
+        self.assertEqual(
+            trace['otherData']['endpoint'], 'GET InventoryViewSet.list')
+        self.assertEqual(categories, {'view', 'serializer', 'sql'})
+        # Plans are added once the request is done, outside its spans
+        self.assertTrue(sql_events[0]['args']['plan'])
+        self.assertNotIn('EXPLAIN failed', sql_events[0]['args']['plan'][0])
+
+        # The list query runs before serialization, not inside its span
+        serializer_span = next(
+            event for event in trace['traceEvents']
+            if event['cat'] == 'serializer')
+        serializer_end = serializer_span['ts'] + serializer_span['dur']
+        self.assertFalse([
+            event for event in sql_events
+            if serializer_span['ts'] <= event['ts'] < serializer_end])
+
+        out = StringIO()
+        call_command('trace_summary', file=str(self.trace_file), stdout=out)
+        self.assertIn('GET InventoryViewSet.list', out.getvalue())
+
+    def test_unsampled_request_is_not_traced(self):
+        """
+        Ensure nothing is written when the request isn't sampled.
+        """
+        url = reverse('core:inventory-list')
+        with self.settings(TRACING_SAMPLE_RATE=0,
+                           TRACING_FILE=self.trace_file):
+            self.client.get(url, format='json')
+
+        self.assertFalse(self.trace_file.exists())
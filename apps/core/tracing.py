@@ -0,0 +1,252 @@
+"""
+Opt-in sampled request tracing.
+
+A sampled request records a span tree (view, serializer and SQL spans) plus a
+statistical stack profile, and is written as one Trace Event Format object
+per line to a rotating file. Unsampled requests only pay for a random draw.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from collections import Counter
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import connection
+
+
+MAX_STACK_DEPTH = 64
+
+_local = threading.local()
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, explain=False):
+        self.id = uuid.uuid4().hex
+        self.thread_id = threading.get_ident()
+        self.explain = explain
+        # (span args, connection, sql, params) of the queries to EXPLAIN once
+        # the request is done, so their plans don't inflate its spans
+        self.to_explain = []
+        self.origin = time.perf_counter()
+        self.events = []
+        self.samples = Counter()
+
+    def add_span(self, name, category, start, end, args=None):
+        self.events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self.origin) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': self.thread_id,
+            'args': args or {},
+        })
+
+    def to_json(self, endpoint, status_code):
+        return json.dumps({
+            'traceEvents': self.events,
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'trace_id': self.id,
+                'endpoint': endpoint,
+                'status': status_code,
+                'stacks': dict(self.samples),
+            },
+        })
+
+
+class Sampler(threading.Thread):
+    """
+    Background thread that periodically records the stack of every thread
+    with an active trace. It sleeps on an event while nothing is traced.
+    """
+    def __init__(self):
+        super().__init__(name='trace-sampler', daemon=True)
+        self.traces = {}
+        self.lock = threading.Lock()
+        self.active = threading.Event()
+
+    def register(self, trace):
+        with self.lock:
+            self.traces[trace.thread_id] = trace
+            self.active.set()
+
+    def unregister(self, trace):
+        with self.lock:
+            self.traces.pop(trace.thread_id, None)
+            if not self.traces:
+                self.active.clear()
+
+    def run(self):
+        while True:
+            self.active.wait()
+            time.sleep(settings.TRACING_PROFILE_INTERVAL)
+
+            with self.lock:
+                traces = list(self.traces.values())
+            frames = sys._current_frames()
+
+            for trace in traces:
+                frame = frames.get(trace.thread_id)
+                if frame is not None:
+                    trace.samples[collapse_stack(frame)] += 1
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    global _sampler
+
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = Sampler()
+            _sampler.start()
+        return _sampler
+
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def get_trace_logger():
+    path = str(settings.TRACING_FILE)
+
+    with _loggers_lock:
+        if path not in _loggers:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            handler = RotatingFileHandler(
+                path, maxBytes=settings.TRACING_MAX_BYTES,
+                backupCount=settings.TRACING_BACKUP_COUNT)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+
+            logger = logging.getLogger(f'core.tracing.{len(_loggers)}')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _loggers[path] = logger
+
+        return _loggers[path]
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def span(name, category='app', **args):
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, category, start, time.perf_counter(), args)
+
+
+def explain_sql(db_connection, sql, params):
+    vendor = db_connection.vendor
+    prefix = 'EXPLAIN QUERY PLAN ' if vendor == 'sqlite' else 'EXPLAIN '
+
+    try:
+        with db_connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [' '.join(str(column) for column in row)
+                    for row in cursor.fetchall()]
+    except Exception as exc:
+        return [f"EXPLAIN failed: {exc}"]
+
+
+def explain_trace(trace):
+    """
+    Adds the plans of the trace's collected queries to their SQL spans.
+    """
+    for args, db_connection, sql, params in trace.to_explain:
+        args['plan'] = explain_sql(db_connection, sql, params)
+    trace.to_explain = []
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    trace = current_trace()
+    if trace is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        end = time.perf_counter()
+        args = {'sql': sql}
+        if (trace.explain and not many and
+                sql.lstrip()[:6].upper() == 'SELECT'):
+            trace.to_explain.append(
+                (args, context['connection'], sql, params))
+        trace.add_span('sql', 'sql', start, end, args)
+
+
+def should_sample(request):
+    """
+    Returns whether to trace the request and whether to EXPLAIN its SQL. In
+    DEBUG, an `X-Trace: 1` or `X-Trace: explain` header forces a trace.
+    """
+    forced = settings.DEBUG and request.headers.get('X-Trace')
+    if forced:
+        return True, forced == 'explain' or settings.TRACING_EXPLAIN
+
+    sampled = random.random() < settings.TRACING_SAMPLE_RATE
+    return sampled, sampled and settings.TRACING_EXPLAIN
+
+
+class TracedViewMixin:
+    """
+    Traces a sample of the requests dispatched to the view.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        sampled, explain = should_sample(request)
+        if not sampled or current_trace() is not None:
+            return super().dispatch(request, *args, **kwargs)
+
+        trace = Trace(explain=explain)
+        _local.trace = trace
+        sampler = get_sampler()
+        sampler.register(trace)
+        response = None
+
+        try:
+            with connection.execute_wrapper(sql_wrapper):
+                with span(type(self).__name__, 'view', path=request.path):
+                    response = super().dispatch(request, *args, **kwargs)
+            return response
+        finally:
+            sampler.unregister(trace)
+            _local.trace = None
+            explain_trace(trace)
+
+            endpoint = f"{request.method} {type(self).__name__}"
+            action = getattr(self, 'action', None)
+            if action:
+                endpoint = f"{endpoint}.{action}"
+            status_code = response.status_code if response is not None else 500
+
+            get_trace_logger().info(trace.to_json(endpoint, status_code))
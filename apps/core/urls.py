@@ -10,9 +10,12 @@ app_name = "core"
 
 urlpatterns = [
     path('', views.CoinView.as_view(), name='coin'),
+    path('sync/', views.SyncView.as_view(), name='sync'),
 ]
 
 
 router = DefaultRouter()
 router.register(r'inventory', views.InventoryViewSet, basename='inventory')
+router.register(r'items', views.ItemViewSet, basename='items')
+router.register(r'jobs', views.JobViewSet, basename='jobs')
 urlpatterns += router.urls
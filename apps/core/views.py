@@ -4,15 +4,27 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from django_filters.rest_framework import DjangoFilterBackend
+
 from django.conf import settings
+from django.db import transaction
 from django.http import Http404
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
 
 from core.error_messages import API_ERROR_MESSAGES
-from core.models import CoinsAmount, MachineItem, MAX_MACHINE_ITEMS
-from core.serializers import CoinsAmountSerializer, MachineItemSerializer
-
-
-class CoinView(APIView):
+from core.filters import ItemFilter, MachineItemFilter
+from core.jobs import enqueue
+from core.models import CoinsAmount, Item, Job, MachineItem
+from core.pagination import IdCursorPagination
+from core.serializers import (
+    CoinsAmountSerializer, ItemSerializer, JobSerializer,
+    MachineItemSerializer, SyncSerializer)
+from core.sync import apply_vends, changes_since
+from core.tracing import span, TracedViewMixin
+
+
+class CoinView(TracedViewMixin, APIView):
     def get_object(self):
         try:
             return CoinsAmount.objects.get(pk=settings.DEFAULT_COIN_AMOUNT)
@@ -24,7 +36,7 @@ class CoinView(APIView):
 
         headers = {
             'Access-Control-Expose-Headers': "X-Coins",
-            'X-Coins': coins_amount.count
+            'X-Coins': coins_amount.get_count()
         }
 
         return Response(status=status.HTTP_204_NO_CONTENT, headers=headers)
@@ -38,8 +50,9 @@ class CoinView(APIView):
             'coin': coins_amount_data
         }
 
-        serializer = CoinsAmountSerializer(data=data)
-        serializer.is_valid(raise_exception=True)
+        with span('CoinsAmountSerializer', 'serializer'):
+            serializer = CoinsAmountSerializer(data=data)
+            serializer.is_valid(raise_exception=True)
 
         if coins_amount_data > settings.MAX_COINS_AMOUNT:
             raise ValidationError(API_ERROR_MESSAGES['invalid_coins_amount'])
@@ -56,8 +69,7 @@ class CoinView(APIView):
 
     def delete(self, request, pk=None, format=None):
         coins_amount = self.get_object()
-        returned_count = coins_amount.count
-        coins_amount.reset_count()
+        returned_count = coins_amount.reset_count()
 
         headers = {
             'Access-Control-Expose-Headers': "X-Coins",
@@ -73,9 +85,15 @@ class CoinView(APIView):
         return response
 
 
-class InventoryViewSet(mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
-    queryset = MachineItem.objects.all()
+class InventoryViewSet(TracedViewMixin, mixins.ListModelMixin,
+                       mixins.UpdateModelMixin, viewsets.GenericViewSet):
+    # Prefetching keeps the page query free of the item join, so slot-only
+    # filters can walk the slot table in id order
+    queryset = MachineItem.objects.prefetch_related('item')
     serializer_class = MachineItemSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = MachineItemFilter
+    pagination_class = IdCursorPagination
 
     def get_object(self, pk=None):
         try:
@@ -83,28 +101,49 @@ class InventoryViewSet(mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.
         except MachineItem.DoesNotExist:
             raise Http404
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            # Fetch the rows first so the serializer span only times
+            # serialization
+            page = list(queryset)
+
+        with span('MachineItemSerializer', 'serializer'):
+            data = self.get_serializer(page, many=True).data
+
+        if self.paginator is not None:
+            return self.get_paginated_response(data)
+
+        return Response(data)
+
+    # One transaction, so the vend's writes share a single sync version
+    @transaction.atomic
     def update(self, request, pk=None, *args, **kwargs):
         machine_item = self.get_object(pk=pk)
 
         coins_amount = CoinsAmount.objects.get(
             pk=settings.DEFAULT_COIN_AMOUNT)
+        coins_count = coins_amount.get_count()
 
         if machine_item.count == 0:
             headers = {
                 'Access-Control-Expose-Headers': "X-Coins",
-                'X-Coins': coins_amount.count
+                'X-Coins': coins_count
             }
 
             coins_amount.reset_count()
 
             return Response(status=status.HTTP_404_NOT_FOUND, headers=headers)
 
-        if coins_amount.value * coins_amount.count >= machine_item.item.price:
+        if coins_amount.value * coins_count >= machine_item.item.price:
             _, new_stock = machine_item.subtract_to_count(1)
 
+            # The change is dispensed right away, so the coins are reset
+            # instead of being subtracted first
             coins_used = machine_item.item.price // coins_amount.value
-            _, new_count = coins_amount.subtract_to_count(coins_used)
-            coins_amount.reset_count()
+            new_count = coins_amount.reset_count() - coins_used
 
             headers = {
                 'Access-Control-Expose-Headers': "X-Inventory-Remaining, X-Coins",
@@ -120,7 +159,7 @@ class InventoryViewSet(mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.
         else:
             headers = {
                 'Access-Control-Expose-Headers': "X-Coins",
-                'X-Coins': coins_amount.count
+                'X-Coins': coins_count
             }
 
             coins_amount.reset_count()
@@ -133,9 +172,41 @@ class InventoryViewSet(mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.
 
     @action(detail=False, methods=['post'])
     def refill(self, request, *args, **kwargs):
-        self.get_queryset().update(count=MAX_MACHINE_ITEMS)
+        job = enqueue('refill')
+
+        serializer = JobSerializer(job)
+
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class ItemViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    queryset = Item.objects.all()
+    serializer_class = ItemSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ItemFilter
+    pagination_class = IdCursorPagination
+
+
+class JobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+
+
+@method_decorator(gzip_page, name='dispatch')
+class SyncView(TracedViewMixin, APIView):
+    """
+    Reconciles a machine that may have been vending offline. The machine sends
+    the vends it recorded and the last version it acknowledged, and gets back
+    only the slot and coin counts changed since then.
+    """
+    def post(self, request):
+        with span('SyncSerializer', 'serializer'):
+            serializer = SyncSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+
+        rejected = apply_vends(serializer.validated_data['vends'])
 
-        serializer = MachineItemSerializer(
-            self.get_queryset().all(), many=True)
+        body = changes_since(serializer.validated_data['since'])
+        body['rejected'] = rejected
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(body, status=status.HTTP_200_OK)
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'core',
+    'django_filters',
     'rest_framework'
 ]
 
@@ -149,3 +150,35 @@ ALLOWED_HOSTS = env("DJANGO_ALLOWED_HOSTS").split(" ")
 
 DEFAULT_COIN_AMOUNT = '0.25'
 MAX_COINS_AMOUNT = 1
+
+# Seconds after which a missing sync version is taken as rolled back
+SYNC_IN_FLIGHT_TIMEOUT = 60
+SYNC_PRUNE_INTERVAL = 300
+# Seconds deleted slot tombstones are kept, machines syncing less often
+# than this get a full snapshot
+SYNC_TOMBSTONE_RETENTION = 7 * 24 * 60 * 60
+
+JOBS_MAX_ATTEMPTS = 3
+JOBS_RETRY_DELAY = 5
+JOBS_POLL_INTERVAL = 1
+# Running jobs not renewed for this many seconds are taken back from their
+# worker. Pooled jobs are renewed every JOBS_HEARTBEAT_INTERVAL, inline jobs
+# must finish within the lease.
+JOBS_LEASE_TIMEOUT = 600
+JOBS_HEARTBEAT_INTERVAL = 30
+JOBS_REFILL_CHUNK_SIZE = 1000
+# Finished jobs are deleted this many seconds after they last ran
+JOBS_RETENTION = 7 * 24 * 60 * 60
+JOBS_PRUNE_INTERVAL = 60 * 60
+
+# Spread CoinsAmount writes over this many shard rows (0 or 1 disables it)
+COUNTABLE_SHARDS = env.int('COUNTABLE_SHARDS', default=0)
+COUNTABLE_COMPACT_INTERVAL = 60
+
+# Fraction of requests traced by core.tracing, see `manage.py trace_summary`
+TRACING_SAMPLE_RATE = env.float('TRACING_SAMPLE_RATE', default=0.0)
+TRACING_EXPLAIN = env.bool('TRACING_EXPLAIN', default=False)
+TRACING_FILE = BASE_DIR / "traces" / "traces.jsonl"
+TRACING_MAX_BYTES = 10 * 1024 * 1024
+TRACING_BACKUP_COUNT = 5
+TRACING_PROFILE_INTERVAL = 0.005